@@ -25,46 +25,144 @@ according to your constraints:
 ==============================================================
 """
 
+import contextlib
+import fnmatch
+import functools
+import hashlib
 import io
 import os
 import re
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+import pikepdf
+from pikepdf import Dictionary, Name
+
+A4 = (595.2755905511812, 841.8897637795277)  # points
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+PREFETCH_THREADS = 8
+
+_LECTURE_PAT = re.compile(r"(\d{3})([a-z])\.pdf", re.IGNORECASE).fullmatch
+_EXAMPLE_PAT = re.compile(r"ex(\d{3})prb\.pdf", re.IGNORECASE).fullmatch
+# Slot per letter in ASCII order (A-Z then a-z), the order sorted() gives.
+_LETTER_SLOT = {c: i for i, c in enumerate(string.ascii_uppercase + string.ascii_lowercase)}
+
+
+# -------------------------------------------------------------
+# Helper: open each source PDF only once
+# -------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def get_reader(path):
+    # The cache also keeps every source open until the output is saved,
+    # which pikepdf needs since it reads foreign page data lazily. Mapping
+    # the file lets the page cache supply bytes on demand instead of
+    # holding a private copy of every input.
+    return pikepdf.open(path, access_mode=pikepdf.AccessMode.mmap)
 
 
 # -------------------------------------------------------------
 # Helper: create a dot filler page
 # -------------------------------------------------------------
+_filler_cache = {}
+
+
 def create_dot_page(width_pts, height_pts):
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=(width_pts, height_pts))
-    c.setFont("Helvetica", 8)
-    c.setFillColorRGB(0, 0, 0)
-    c.drawString(20, 20, ".")
-    c.showPage()
-    c.save()
-    buf.seek(0)
-    return PdfReader(buf).pages[0]
+    key = (width_pts, height_pts)
+    if key not in _filler_cache:
+        # A single "." in 8pt Helvetica at (20, 20), built directly
+        # rather than rendering a PDF and parsing it back.
+        pdf = pikepdf.Pdf.new()
+        page = pdf.add_blank_page(page_size=(width_pts, height_pts))
+        font = Dictionary(Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica)
+        page.Resources = Dictionary(Font=Dictionary(F1=pdf.make_indirect(font)))
+        page.Contents = pdf.make_stream(b"BT /F1 8 Tf 20 20 Td (.) Tj ET")
+        # Cache the Pdf itself: a page does not keep its owner alive.
+        _filler_cache[key] = pdf
+    return _filler_cache[key].pages[0]
+
+
+# -------------------------------------------------------------
+# Helper: share identical streams across source files
+# -------------------------------------------------------------
+def dedupe_streams(pdf):
+    """
+    Points every reference to a byte-identical stream (same dictionary
+    and raw data) at one copy, so fonts and images embedded by several
+    lecture files are written once. Returns the number of streams dropped.
+    """
+    canonical = {}
+    remap = {}
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        key = (hashlib.sha1(obj.read_raw_bytes()).digest(), obj.stream_dict.unparse())
+        first = canonical.setdefault(key, obj)
+        if first.objgen != obj.objgen:
+            remap[obj.objgen] = first
+    if not remap:
+        return 0
+
+    def relink(container):
+        if isinstance(container, pikepdf.Array):
+            keys = range(len(container))
+        else:
+            keys = container.keys()
+        for k in keys:
+            v = container[k]
+            if not isinstance(v, pikepdf.Object):
+                continue
+            if v.is_indirect:
+                if v.objgen in remap:
+                    container[k] = remap[v.objgen]
+            elif isinstance(v, (pikepdf.Dictionary, pikepdf.Array)):
+                relink(v)
+
+    # Duplicates left unreferenced are not written out on save.
+    for obj in pdf.objects:
+        if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream, pikepdf.Array)):
+            relink(obj)
+    return len(remap)
 
 
 # -------------------------------------------------------------
 # Collect files
 # -------------------------------------------------------------
+def list_pdf_names(folder, name_glob):
+    """
+    Returns the names of regular files in folder matching name_glob, so
+    the regexes only run over files that already have the right shape.
+    """
+    with os.scandir(folder) as it:
+        return [
+            e.name
+            for e in it
+            if fnmatch.fnmatchcase(e.name, name_glob) and e.is_file(follow_symlinks=False)
+        ]
+
+
 def collect_lecture_files(folder):
     """
     Collects lecture files like 001a.pdf, 001b.pdf, etc.
     Returns dict: { "001": ["001a.pdf", "001b.pdf", ...], ... }
+    with each list already in letter order.
     """
-    mapping = {}
-    pattern = re.compile(r"(\d{3})([a-z])\.pdf", re.IGNORECASE)
-    for f in sorted(os.listdir(folder)):
-        m = pattern.match(f)
+    # One slot per letter, so only names sharing a letter (e.g. 001a.pdf
+    # and 001a.PDF) ever need sorting; that keeps the sorted() order.
+    buckets = {}
+    for f in list_pdf_names(folder, "[0-9][0-9][0-9][a-zA-Z].[pP][dD][fF]"):
+        m = _LECTURE_PAT(f)
         if m:
-            num = m.group(1)
-            mapping.setdefault(num, []).append(os.path.join(folder, f))
-    return mapping
+            num, letter = m.groups()
+            slots = buckets.setdefault(num, [[] for _ in _LETTER_SLOT])
+            slots[_LETTER_SLOT[letter]].append(f)
+    return {
+        num: [os.path.join(folder, f) for names in slots for f in sorted(names)]
+        for num, slots in buckets.items()
+    }
 
 
 def collect_example_files(folder):
@@ -73,9 +171,8 @@ def collect_example_files(folder):
     Returns dict: { "001": "ex001prb.pdf", ... }
     """
     mapping = {}
-    pattern = re.compile(r"ex(\d{3})prb\.pdf", re.IGNORECASE)
-    for f in os.listdir(folder):
-        m = pattern.match(f)
+    for f in list_pdf_names(folder, "[eE][xX][0-9][0-9][0-9][pP][rR][bB].[pP][dD][fF]"):
+        m = _EXAMPLE_PAT(f)
         if m:
             num = m.group(1)
             mapping[num] = os.path.join(folder, f)
@@ -83,69 +180,202 @@ def collect_example_files(folder):
 
 
 # -------------------------------------------------------------
-# STEP 1: Gather files
+# Plan one lecture block
 # -------------------------------------------------------------
-lecture_folder = "lecture-notes"
-example_folder = "examples/problems"
+def plan_group(num, paths, ex_path):
+    """
+    Works out what goes into the block for one lecture number.
+    Returns (used_paths, pages_added, page_size, log_lines), where
+    used_paths are the files contributing pages (all but their last)
+    and a filler of page_size is needed when pages_added is odd.
+    """
+    log = [f"\n🔹 Processing Lecture {num}"]
+    used = []
+    last_path = None
+    page_size = None
+    pages_added = 0
+
+    # ---- Lecture files, then the example if it exists ----
+    for path in paths:
+        log.append(f"   📘 Adding {os.path.basename(path)} (excluding last page)")
+    if ex_path is not None:
+        log.append(f"   🧩 Adding Example {os.path.basename(ex_path)} (excluding last page)")
+    else:
+        log.append("   ⚠️ No example found for this lecture.")
+
+    for path in paths + ([ex_path] if ex_path is not None else []):
+        n_pages = len(get_reader(path).pages)
+        if n_pages == 0:
+            continue
+        last_path = path
+        if n_pages > 1:
+            used.append(path)
+            pages_added += n_pages - 1
+
+    # ---- Ensure even page count ----
+    if pages_added % 2 != 0:
+        log.append("   ➕ Adding filler page with a '.' to make page count even.")
+        # Only now is the page size needed; the reader is still cached.
+        if last_path is None:
+            page_size = A4
+        else:
+            mediabox = get_reader(last_path).pages[0].mediabox
+            page_size = (
+                float(mediabox[2] - mediabox[0]),
+                float(mediabox[3] - mediabox[1]),
+            )
 
-lectures = collect_lecture_files(lecture_folder)
-examples = collect_example_files(example_folder)
+    return used, pages_added, page_size, log
 
-print(f"📚 Found {len(lectures)} lecture groups and {len(examples)} example PDFs.\n")
 
-out = PdfWriter()
+def print_block_log(log):
+    # One write and flush per lecture instead of one per line.
+    sys.stdout.write("\n".join(log) + "\n")
+    sys.stdout.flush()
+
 
 # -------------------------------------------------------------
-# STEP 2: Merge PDFs by lecture number
+# Merge with the qpdf CLI
 # -------------------------------------------------------------
-for num in sorted(lectures.keys()):
-    print(f"\n🔹 Processing Lecture {num}")
-
-    page_width = None
-    page_height = None
-    start_page_count = len(out.pages)
-
-    # ---- Merge lecture files ----
-    for path in sorted(lectures[num]):
-        print(f"   📘 Adding {os.path.basename(path)} (excluding last page)")
-        r = PdfReader(path)
-        if len(r.pages) == 0:
-            continue
-        if page_width is None:
-            p0 = r.pages[0]
-            page_width = float(p0.mediabox.width)
-            page_height = float(p0.mediabox.height)
-        for i in range(max(0, len(r.pages) - 1)):
-            out.add_page(r.pages[i])
-
-    # ---- Merge example if exists ----
-    if num in examples:
-        ex_path = examples[num]
-        print(f"   🧩 Adding Example {os.path.basename(ex_path)} (excluding last page)")
-        r = PdfReader(ex_path)
-        if len(r.pages) > 0:
-            if page_width is None:
-                p0 = r.pages[0]
-                page_width = float(p0.mediabox.width)
-                page_height = float(p0.mediabox.height)
-            for i in range(max(0, len(r.pages) - 1)):
-                out.add_page(r.pages[i])
-    else:
-        print("   ⚠️ No example found for this lecture.")
+def merge_with_qpdf(jobs, tmp_path, closer):
+    """
+    Concatenates every block with `qpdf --empty --pages`, which stitches
+    page objects together without decoding content streams, then inserts
+    the filler pages in a short pikepdf pass. Returns the merged Pdf,
+    which reads from tmp_path until it is saved; closer (an ExitStack)
+    closes it.
+    """
+    # Open every source up front on a few threads so disk reads overlap
+    # instead of stalling each page-count probe below.
+    all_paths = [
+        path
+        for _, paths, ex_path in jobs
+        for path in paths + ([ex_path] if ex_path is not None else [])
+    ]
+    with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as executor:
+        list(executor.map(get_reader, all_paths))
+
+    args = []
+    fillers = []  # (index in the qpdf output, page size)
+    total = 0
+    for job in jobs:
+        used, pages_added, page_size, log = plan_group(*job)
+        print_block_log(log)
+        for path in used:
+            args += [path, "1-r2"]
+        total += pages_added
+        if pages_added % 2 != 0:
+            fillers.append((total, page_size))
+
+    if not args:
+        return closer.enter_context(pikepdf.Pdf.new())
+
+    # qpdf exits with 3 when it succeeded with warnings (e.g. after
+    # recovering a damaged xref table); only 2 means the output is bad.
+    cmd = ["qpdf", "--empty", "--pages", *args, "--", tmp_path]
+    result = subprocess.run(cmd)
+    if result.returncode not in (0, 3):
+        raise subprocess.CalledProcessError(result.returncode, cmd)
+
+    # Import each filler once; later inserts reuse the local copy rather
+    # than going through foreign-object copying again.
+    out = closer.enter_context(pikepdf.open(tmp_path, access_mode=pikepdf.AccessMode.mmap))
+    local_fillers = {}
+    for shift, (index, page_size) in enumerate(fillers):
+        if page_size not in local_fillers:
+            filler = create_dot_page(*page_size)
+            local_fillers[page_size] = pikepdf.Page(out.copy_foreign(filler.obj))
+        out.pages.insert(index + shift, local_fillers[page_size])
+    return out
 
-    # ---- Ensure even page count ----
-    pages_added = len(out.pages) - start_page_count
-    if pages_added % 2 != 0:
-        print("   ➕ Adding filler page with a '.' to make page count even.")
-        if page_width is None or page_height is None:
-            page_width, page_height = A4
-        out.add_page(create_dot_page(page_width, page_height))
 
 # -------------------------------------------------------------
-# STEP 3: Save final output
+# Merge with pikepdf in worker processes
 # -------------------------------------------------------------
-out_path = "lecture-notes-and-examples-merged.pdf"
-with open(out_path, "wb") as fo:
-    out.write(fo)
+def build_group(num, paths, ex_path, block_path):
+    """
+    Builds the block for one lecture number in its own process and
+    writes it to block_path, so finished blocks live on disk rather than
+    in memory. Returns the log lines for the parent to print in order.
+    """
+    used, pages_added, page_size, log = plan_group(num, paths, ex_path)
+    out = pikepdf.Pdf.new()
+    for path in used:
+        out.pages.extend(get_reader(path).pages[:-1])
+    if pages_added % 2 != 0:
+        out.pages.append(create_dot_page(*page_size))
+
+    out.save(block_path, stream_decode_level=pikepdf.StreamDecodeLevel.none)
+    return log
+
+
+def merge_in_processes(jobs, tmp_dir, closer):
+    """
+    Builds blocks in parallel with build_group and concatenates them in
+    order. Returns the merged Pdf; the blocks it still reads from are
+    registered on closer (an ExitStack) as soon as they are opened.
+    """
+    block_paths = [os.path.join(tmp_dir, f"{num}.pdf") for num, _, _ in jobs]
+    out = closer.enter_context(pikepdf.Pdf.new())
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        logs = executor.map(build_group, *zip(*jobs), block_paths)
+        for log, block_path in zip(logs, block_paths):
+            print_block_log(log)
+            group = pikepdf.open(block_path, access_mode=pikepdf.AccessMode.mmap)
+            closer.enter_context(group)
+            out.pages.extend(group.pages)
+    return out
+
+
+def main():
+    # ---------------------------------------------------------
+    # STEP 1: Gather files
+    # ---------------------------------------------------------
+    lecture_folder = "lecture-notes"
+    example_folder = "examples/problems"
+
+    lectures = collect_lecture_files(lecture_folder)
+    examples = collect_example_files(example_folder)
+
+    print(f"📚 Found {len(lectures)} lecture groups and {len(examples)} example PDFs.\n")
+
+    jobs = [
+        (num, lectures[num], examples.get(num))
+        for num in sorted(lectures.keys())
+    ]
+
+    # `closer` exits first, so every mapping inside tmp_dir is released
+    # before the directory is deleted, on success or error alike.
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.ExitStack() as closer:
+        # -----------------------------------------------------
+        # STEP 2: Merge PDFs by lecture number
+        # -----------------------------------------------------
+        if shutil.which("qpdf"):
+            out = merge_with_qpdf(jobs, os.path.join(tmp_dir, "concat.pdf"), closer)
+        else:
+            out = merge_in_processes(jobs, tmp_dir, closer)
+
+        # -----------------------------------------------------
+        # STEP 3: Save final output
+        # -----------------------------------------------------
+        shared = dedupe_streams(out)
+        print(f"\n🧹 Shared {shared} duplicate streams between source files.")
+
+        out_path = "lecture-notes-and-examples-merged.pdf"
+        with open(out_path, "wb", buffering=0) as raw, io.BufferedWriter(
+            raw, buffer_size=WRITE_BUFFER_SIZE
+        ) as fo:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(raw.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            out.save(
+                fo,
+                linearize=False,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                stream_decode_level=pikepdf.StreamDecodeLevel.none,
+            )
+
+    print(f"\n✅ Done! Final merged PDF saved as: {out_path}")
+
 
-print(f"\n✅ Done! Final merged PDF saved as: {out_path}")
+if __name__ == "__main__":
+    main()